@@ -0,0 +1,106 @@
+from collections import Counter
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def get_lab_weights(scale):
+    """
+    Return the weights to multiply Lab values by for the given scale.
+
+    Multiplying each Lab component by the square root of its scale turns the
+    scaled distance into a plain Euclidean distance.
+
+    :param scale: list[float]
+    :return: numpy.ndarray of shape (3,)
+    """
+    return np.sqrt(np.asarray(scale, dtype=np.float64))
+
+
+class SwatchIndex(object):
+    """
+    Hold the Lab values of a set of swatches for searching.
+
+    The Lab values are stored as an (N, 3) array, along with a parallel array
+    of the swatch IDs. The index is a snapshot of the swatches it was built
+    from; build a new one if they change.
+    """
+
+    # Building a KD-tree costs about as much as 10-15 linear scans of the
+    # swatches, so one is only worth building for a scale after this many
+    # searches with it.
+    TREE_MIN_SEARCHES = 16
+
+    def __init__(self, swatches, tree_min_searches=None):
+        """
+        Instantiate a SwatchIndex.
+
+        :param swatches: list[sqlalchemy.engine.Row] or list[Swatch]
+        :param tree_min_searches: int or None, defaults to TREE_MIN_SEARCHES
+        """
+        if tree_min_searches is None:
+            tree_min_searches = self.TREE_MIN_SEARCHES
+        self.tree_min_searches = tree_min_searches
+        swatches = list(swatches)
+        self.ids = np.asarray([s.id for s in swatches])
+        self.matrix = np.ascontiguousarray(
+            [[s.lab_l, s.lab_a, s.lab_b] for s in swatches],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+        self.by_id = {s.id: s for s in swatches}
+        self._scaled = dict()
+        self._trees = dict()
+        self._searches = Counter()
+
+    def __len__(self):
+        """
+        Return the number of swatches in the index.
+
+        :return: int
+        """
+        return len(self.ids)
+
+    def get_matrix(self, scale=None):
+        """
+        Return the (scaled) Lab values of the swatches.
+
+        If a scale is given, the Lab values are pre-multiplied by the weights
+        from `get_lab_weights`. This is done once per scale.
+
+        :param scale: list[float] or None
+        :return: numpy.ndarray of shape (N, 3)
+        """
+        if scale is None:
+            return self.matrix
+        key = tuple(scale)
+        if key not in self._scaled:
+            self._scaled[key] = self.matrix * get_lab_weights(scale)
+        return self._scaled[key]
+
+    def use_tree(self, scale):
+        """
+        Record a search with the given scale and tell if it should use a tree.
+
+        Searches use a linear scan until `tree_min_searches` searches with the
+        same scale have been made, so one-off searches never pay for a tree.
+
+        :param scale: list[float]
+        :return: bool
+        """
+        key = tuple(scale)
+        self._searches[key] += 1
+        return self._searches[key] > self.tree_min_searches
+
+    def get_tree(self, scale):
+        """
+        Return a KD-tree over the scaled Lab values of the swatches.
+
+        The tree is built on first use for each scale and reused afterwards.
+
+        :param scale: list[float]
+        :return: scipy.spatial.cKDTree
+        """
+        key = tuple(scale)
+        if key not in self._trees:
+            self._trees[key] = cKDTree(self.get_matrix(scale))
+        return self._trees[key]
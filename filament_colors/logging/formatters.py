@@ -9,17 +9,11 @@ class ExtraFormatter(logging.Formatter):
     `extra`.
     """
 
-    def __init__(self, *args, **kwargs):
-        """
-        Instantiate an ExtraFormatter.
-
-        :param args: any
-        :param kwargs: any
-        """
-        super().__init__(*args, **kwargs)
-        self._normal_keys = vars(
-            logging.LogRecord('', 0, '', 0, '', {}, None)
-        ).keys()
+    # The attributes of a plain LogRecord, anything else was given as `extra`.
+    _NORMAL_KEYS = frozenset(
+        vars(logging.LogRecord('', 0, '', 0, '', {}, None)).keys()
+    )
+    _NUM_NORMAL_KEYS = len(_NORMAL_KEYS)
 
     def get_extra(self, record):
         """
@@ -30,7 +24,7 @@ class ExtraFormatter(logging.Formatter):
         """
         extra = {
             k: v for k, v in vars(record).items()
-            if k not in self._normal_keys
+            if k not in self._NORMAL_KEYS
         }
         return extra
 
@@ -41,8 +35,11 @@ class ExtraFormatter(logging.Formatter):
         :param record: LogRecord
         :return: dict
         """
-        extra = self.get_extra(record)
-        if extra:
-            extras = [f'{k}="{str(v)}"' for k, v in extra.items()]
-            record.msg = f"{record.msg} [{', '.join(extras)}]"
+        # Most records carry no extra values, so skip building them at all.
+        # Every record has all of the normal keys, so any extra values show
+        # up as additional attributes.
+        if len(vars(record)) == self._NUM_NORMAL_KEYS:
+            return super().format(record)
+        extras = [f'{k}="{str(v)}"' for k, v in self.get_extra(record).items()]
+        record.msg = f"{record.msg} [{', '.join(extras)}]"
         return super().format(record)
@@ -1,15 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 import logging
-from math import sqrt
+from math import ceil, sqrt
 from pathlib import Path
 import sys
 
 from colormath.color_objects import sRGBColor, LabColor
+from colormath.color_constants import CIE_E, ILLUMINANTS
 from colormath.color_conversions import convert_color
+import numpy as np
 import requests
 import sqlalchemy as db
 from sqlalchemy.orm import sessionmaker
 
+from .index import SwatchIndex, get_lab_weights
 from .logging.formatters import ExtraFormatter
 from .swatch import Base, Swatch
 
@@ -17,27 +21,84 @@ from .swatch import Base, Swatch
 BASE_URL = 'https://filamentcolors.xyz/api'
 DB_FILE_NAME = Path('filamentcolors.sqlite3')
 DB_URL = f'sqlite:///{DB_FILE_NAME}'
+MAX_API_WORKERS = 8
+# Seconds to wait to connect to, then for each read from, the API.
+API_TIMEOUT = 30
 
 logger = logging.getLogger(f'filamentcolors.{__name__}')
 
+# Shared by all API requests, so that connections are pooled and kept alive.
+_SESSION = requests.Session()
+
 
 def get_swatches_from_api(page=1):
     """
     Fetch swatch data from the filamentcolors.xyz API.
 
+    Returns None if the request fails, including when it times out.
+
     :param page: int
-    :return: None
+    :return: dict[str, any] or None
     """
     url = f'{BASE_URL}/swatch/'
     if page > 1:
         url += f'?page={int(page)}'
-    req = requests.get(url)
+    try:
+        req = _SESSION.get(url, timeout=API_TIMEOUT)
+    except requests.RequestException as e:
+        logger.error(f'Error on GET: {e}')
+        return None
     if req.status_code == 200:
         return req.json()
     else:
         logger.error('Error on GET')
 
 
+def get_all_swatches_from_api():
+    """
+    Fetch the swatch data of all pages from the filamentcolors.xyz API.
+
+    The first page reveals the total number of swatches, the remaining pages
+    are then fetched in parallel. If the API doesn't report the total, the
+    `next` links are followed one page at a time instead.
+
+    If any page fails, or fewer swatches than reported were received, None
+    is returned, so that a partial list is never stored.
+
+    :return: list[dict[str, any]] or None
+    """
+    data = get_swatches_from_api(page=1)
+    if data is None:
+        return None
+    results = data.get('results', [])
+    count = data.get('count', None)
+    if not data.get('next', None) or not results:
+        return results
+
+    if count is None:
+        page = 1
+        while data.get('next', None):
+            page += 1
+            data = get_swatches_from_api(page=page)
+            if data is None:
+                return None
+            results.extend(data.get('results', []))
+        return results
+
+    num_pages = ceil(count / len(results))
+    with ThreadPoolExecutor(max_workers=MAX_API_WORKERS) as executor:
+        pages = list(executor.map(get_swatches_from_api,
+                                  range(2, num_pages + 1)))
+    if any(data is None for data in pages):
+        return None
+    for data in pages:
+        results.extend(data.get('results', []))
+    if len(results) < count:
+        logger.error(f'Only {len(results)} of {count} swatches were received.')
+        return None
+    return results
+
+
 def populate_db(results, engine, session, force=False):
     """
     Save given swatches (dict form) into the database.
@@ -59,12 +120,13 @@ def populate_db(results, engine, session, force=False):
         meta.create_all(engine, checkfirst=True)
         session.commit()
 
+    hex_colors = [swatch.get('hex_color', '') for swatch in results]
+    lab_colors = construct_lab_colors_from_hex(hex_colors).tolist()
+
     records = list()
-    for swatch in results:
+    for swatch, hex_color, (lab_l, lab_a, lab_b) in zip(results, hex_colors,
+                                                        lab_colors):
         id = swatch.get('id', None)
-        hex_color = swatch.get('hex_color', '')
-        lab_color = construct_lab_color_from_hex(hex_color)
-        lab_l, lab_a, lab_b = lab_color.get_value_tuple()
         records.append({
             'id': id,
             'hex_color': hex_color,
@@ -72,10 +134,10 @@ def populate_db(results, engine, session, force=False):
             'lab_a': lab_a,
             'lab_b': lab_b,
         })
-    Swatch.populate_table_with_records(session=session, records=records)
+    Swatch.populate_table_with_records(session=session, records=records,
+                                       force=force)
 
 
-@lru_cache()
 def construct_lab_color_from_hex(color):
     """
     Compute a LabColor from a given RGB color in hexadecimal format.
@@ -83,82 +145,211 @@ def construct_lab_color_from_hex(color):
     :param color: str
     :return: colormath.color_objects.LabColor
     """
-    components = [int(color[i * 2:][:2], 16) for i in range(3)]
-    a = sRGBColor(*components, is_upscaled=True)
+    if len(color) != 6:
+        raise ValueError('Colors must be given as 6 hexadecimal digits.')
+    try:
+        rgb_r, rgb_g, rgb_b = bytes.fromhex(color)
+    except ValueError:
+        raise ValueError('Colors must be given as 6 hexadecimal digits.')
+    a = sRGBColor(rgb_r, rgb_g, rgb_b, is_upscaled=True)
     return convert_color(a, LabColor)
 
 
+def construct_lab_colors_from_hex(colors):
+    """
+    Compute the Lab values of many RGB colors in hexadecimal format at once.
+
+    This is a vectorized equivalent of `construct_lab_color_from_hex`, using
+    the same sRGB (D65) to Lab conversion and constants as colormath.
+
+    :param colors: list[str]
+    :return: numpy.ndarray of shape (N, 3)
+    """
+    if any(len(color) != 6 for color in colors):
+        raise ValueError('Colors must be given as 6 hexadecimal digits.')
+    try:
+        rgb = np.frombuffer(bytes.fromhex(''.join(colors)), dtype=np.uint8)
+    except ValueError:
+        raise ValueError('Colors must be given as 6 hexadecimal digits.')
+    if len(rgb) != 3 * len(colors):
+        raise ValueError('Colors must be given as 6 hexadecimal digits.')
+    rgb = rgb.reshape(-1, 3) / 255.0
+
+    # Linearize the sRGB channels, then convert to XYZ.
+    linear = np.where(rgb <= 0.04045,
+                      rgb / 12.92,
+                      ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ sRGBColor.conversion_matrices['rgb_to_xyz'].T
+
+    # Convert XYZ to Lab, relative to the sRGB native illuminant (with the
+    # default 2 degree observer).
+    xyz /= ILLUMINANTS['2'][sRGBColor.native_illuminant]
+    xyz = np.where(xyz > CIE_E, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    return np.column_stack((
+        116.0 * xyz[:, 1] - 16.0,
+        500.0 * (xyz[:, 0] - xyz[:, 1]),
+        200.0 * (xyz[:, 1] - xyz[:, 2]),
+    ))
+
+
+@lru_cache(maxsize=4096)
+def _hex_to_lab_tuple(color):
+    """
+    Compute the Lab values of a given RGB color in hexadecimal format.
+
+    :param color: str
+    :return: tuple[float, float, float]
+    """
+    lab_color = construct_lab_color_from_hex(color)
+    return lab_color.lab_l, lab_color.lab_a, lab_color.lab_b
+
+
 def get_swatches_from_db(session):
     """
-    Return a list of dicts representing the rows of the DB.
+    Return a list of named tuples representing the rows of the DB.
+
+    Only the plain column values are fetched, which avoids building full ORM
+    instances for every row.
 
     :param session: sqlalchemy.orm.session.Session
-    :return: list[dict[str, any]] or None
+    :return: list[sqlalchemy.engine.Row] or None
     """
     # If the DB doesn't exist, return None
     if not DB_FILE_NAME.is_file():
         return None
-    return session.query(Swatch).all()
+    return session.execute(db.select(
+        Swatch.id, Swatch.hex_color, Swatch.lab_l, Swatch.lab_a, Swatch.lab_b,
+    )).all()
 
 
 def compute_lab_color_distance(color_a, color_b, scale=None):
     """
-    Compute the Euclidean LabColor distance between input hex RGB colors.
+    Compute the Euclidean Lab distance between the input colors.
+
+    This compares two individual colors; use `find_closest_by_lab` to search
+    a set of swatches.
 
-    :param color_a: str or colormath.color_objects.LabColor
-    :param color_b: str or colormath.color_objects.LabColor
+    :param color_a: str or sequence of float
+    :param color_b: str or sequence of float
     :param scale: iterable of float or None
     :return: float
     """
-    if not isinstance(color_a, LabColor):
-        # If not LabColor, assume it is a hex-formatted RGB color
-        color_a = construct_lab_color_from_hex(color_a)
-    if not isinstance(color_b, LabColor):
-        # If not LabColor, assume it is a hex-formatted RGB color
-        color_b = construct_lab_color_from_hex(color_b)
+    if isinstance(color_a, str):
+        # If a string, assume it is a hex-formatted RGB color
+        color_a = _hex_to_lab_tuple(color_a)
+    if isinstance(color_b, str):
+        # If a string, assume it is a hex-formatted RGB color
+        color_b = _hex_to_lab_tuple(color_b)
+
+    scale_l, scale_a, scale_b = (1.0, 1.0, 1.0) if scale is None else scale
+    delta_l = color_a[0] - color_b[0]
+    delta_a = color_a[1] - color_b[1]
+    delta_b = color_a[2] - color_b[2]
+    return sqrt(delta_l * delta_l * scale_l
+                + delta_a * delta_a * scale_a
+                + delta_b * delta_b * scale_b)
+
+
+def compute_lab_distances_squared(matrix, query, scale=None):
+    """
+    Compute the squared, scaled Lab distances from a query to many colors.
 
-    a_parts = color_a.get_value_tuple()
-    b_parts = color_b.get_value_tuple()
+    The square root is skipped, since it doesn't change the ordering of the
+    distances. Without a scale (e.g. when the matrix and query are already
+    scaled), this is the plain squared Euclidean distance.
 
+    :param matrix: numpy.ndarray of shape (N, 3)
+    :param query: numpy.ndarray of shape (3,)
+    :param scale: iterable of float or None
+    :return: numpy.ndarray of shape (N,)
+    """
+    diff = matrix - query
+    diff *= diff
     if scale is None:
-        scale = [1.0, 1.0, 1.0]
-    deltas = [(a_parts[i] - b_parts[i]) ** 2 * scale[i] for i in range(3)]
-    return sqrt(sum(deltas))
+        return diff.sum(axis=1)
+    return diff @ np.asarray(scale, dtype=np.float64)
+
+
+def _find_nearest_by_scan(index, query, scale, top_num, excluded):
+    """
+    Return the positions of the closest swatches in the index by a scan.
+
+    :param index: filament_colors.index.SwatchIndex
+    :param query: numpy.ndarray of shape (3,), already scaled
+    :param scale: list[float]
+    :param top_num: int
+    :param excluded: frozenset
+    :return: numpy.ndarray
+    """
+    distances = compute_lab_distances_squared(index.get_matrix(scale), query)
+    # Don't even consider excluded colors.
+    candidates = np.flatnonzero(~np.isin(index.ids, list(excluded)))
+    distances = distances[candidates]
+
+    top_num = min(top_num, len(candidates))
+    if top_num < 1:
+        # Every swatch was excluded
+        return candidates
+    # Only the top N need ordering, so select them first in linear time, then
+    # sort just those.
+    nearest = np.argpartition(distances, top_num - 1)[:top_num]
+    return candidates[nearest[np.argsort(distances[nearest])]]
+
+
+def _find_nearest_by_tree(index, query, scale, top_num, excluded):
+    """
+    Return the positions of the closest swatches in the index by a KD-tree.
+
+    :param index: filament_colors.index.SwatchIndex
+    :param query: numpy.ndarray of shape (3,), already scaled
+    :param scale: list[float]
+    :param top_num: int
+    :param excluded: frozenset
+    :return: numpy.ndarray
+    """
+    num = min(top_num + len(excluded), len(index))
+    _, nearest = index.get_tree(scale).query(query, k=num)
+    nearest = np.atleast_1d(nearest)
+    # Excluded colors are dropped from the neighbours afterwards, which is
+    # why enough extra neighbours were requested to replace them.
+    nearest = nearest[~np.isin(index.ids[nearest], list(excluded))]
+    return nearest[:top_num]
 
 
-def find_closest_by_lab(swatches, hex_color, top_num=1, excluded=None,
+def find_closest_by_lab(index, hex_color, top_num=1, excluded=None,
                         scale=None):
     """
     Return the closest color to the given hex_color.
 
-    NOTE: This is probably fine for swatch collection sizes < 1000, but look
-    into better ways of getting the top-N items if there are many more. Also
-    consider doing the comparison and sorting in the DB!
+    A single search scans all swatches with vectorized distances and a
+    partial selection of the top N. Once many searches share the index, a
+    KD-tree over the scaled Lab values is built and queried instead (see
+    `SwatchIndex.use_tree`). The matches are returned closest first, as the
+    same objects the index was built from (rows from `get_swatches_from_db`).
 
-    :param swatches: list[Swatch]
+    :param index: filament_colors.index.SwatchIndex
     :param hex_color: str
     :param scale: list[float]
-    :return: list[Swatch] or None
+    :return: list[sqlalchemy.engine.Row] or list[Swatch]
     """
     # The largest possible distance between 2 (Colormath) Lab colors is 300.0
-    if excluded is None:
-        excluded = []
+    excluded = frozenset(excluded or ())
     if scale is None:
         scale = [1.0, 1.0, 1.0]
-
-    compare_color = construct_lab_color_from_hex(hex_color)
-    computed = dict()
-
-    for swatch in swatches:
-        # Don't even check excluded colors.
-        if swatch.id in excluded:
-            continue
-        dist = compute_lab_color_distance(compare_color,
-                                          swatch.get_lab_color(),
-                                          scale=scale)
-        computed[swatch] = dist
-    ordered = sorted(computed.items(), key=lambda i: i[1])
-    return [k for k, v in ordered[:top_num]]
+    if top_num < 1 or not len(index):
+        return []
+
+    query = np.asarray(_hex_to_lab_tuple(hex_color), dtype=np.float64)
+    query = query * get_lab_weights(scale)
+    if index.use_tree(scale):
+        nearest = _find_nearest_by_tree(index, query, scale, top_num,
+                                        excluded)
+    else:
+        nearest = _find_nearest_by_scan(index, query, scale, top_num,
+                                        excluded)
+    return [
+        index.by_id[swatch_id] for swatch_id in index.ids[nearest].tolist()
+    ]
 
 
 def process(**kwargs):
@@ -183,20 +374,12 @@ def process(**kwargs):
     # Update swatches mode
     update_swatches = kwargs.get('update_swatches', False)
     if update_swatches:
-        page = 1
-        while page:
-            data = get_swatches_from_api(page=page)
-            results = data.get('results', [])
-            # Force the creation of the schema if the DB file doesn't exist,
-            # but only for the first batch.
-            populate_db(results=results, engine=engine, session=session,
-                        force=(not db_exists and page == 1))
-
-            # process_results(results)
-            if data.get('next', None):
-                page += 1
-            else:
-                page = None
+        results = get_all_swatches_from_api()
+        if results is None:
+            return
+        # Force the creation of the schema if the DB file doesn't exist.
+        populate_db(results=results, engine=engine, session=session,
+                    force=not db_exists)
         print(f'There are now {Swatch.get_count_records(session)} swatches '
               f'available.')
         return
@@ -214,9 +397,10 @@ def process(**kwargs):
 
     hex_color = kwargs.get('hex_color', '')
     if hex_color and swatches:
-        excluded = []
+        excluded = frozenset()
         try:
-            excluded = [int(x) for x in kwargs.get('excluded_colors')]
+            excluded = frozenset(
+                int(x) for x in kwargs.get('excluded_colors'))
         except TypeError:
             # The option wasn't used, ignore...
             pass
@@ -226,9 +410,12 @@ def process(**kwargs):
         top_num = int(kwargs.get('top_num', 1))
         method = kwargs.get('method', 'hue')
         scale = [0.01, 1.0, 1.0] if method == 'hue' else None
-        best_matches = find_closest_by_lab(swatches, hex_color,
+        index = SwatchIndex(swatches)
+        best_matches = find_closest_by_lab(index, hex_color,
                                            top_num=top_num, excluded=excluded,
                                            scale=scale)
+        # Only the matches need to be full Swatch instances.
+        best_matches = [Swatch(**row._asdict()) for row in best_matches]
 
         digits = len(str(top_num))
         template = 'ID: {id} ({url}) color: #{hex_color}.'
@@ -1,8 +1,8 @@
 import logging
 
 import sqlalchemy as db
-from colormath.color_objects import LabColor
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import declarative_base
 
 
 Base = declarative_base()
@@ -25,38 +25,50 @@ class TableBase(object):
         return session.query(cls).count()
 
     @classmethod
-    def populate_table_with_records(cls, session, records):
+    def populate_table_with_records(cls, session, records, force=False):
         """
         Populate the table with records as rows.
 
-        Insert the given records into the table and return the IDs assigned to
-        Each row.
+        Insert the given records into the table, updating any rows that
+        already exist, and return the IDs of the given records. This is done
+        with a single SQLite "upsert" statement for all of the records.
+
+        If `force` is set, the table is known to be empty (it was just
+        rebuilt), so the records are bulk inserted without any conflict
+        handling instead. Records sharing a primary key are collapsed first,
+        the last one winning as it would with the upsert.
 
         :param session: sqlalchemy.orm.session.Session
         :param records: list[dict[str, any]]
+        :param force: bool
         :return: list[any]
         """
-        for record in records:
-            swatch_id = record.get('id')
-
-            # Try to get this swatch from the DB
-            swatch = session.query(cls).filter_by(id=swatch_id).first()
-            if swatch:
-                # Updates the Swatch instance with current values
-                for key, value in record.items():
-                    setattr(swatch, key, value)
-                logger.info(f'swatch ({swatch_id}) updated.')
-            else:
-                # Object doesn't exist in the DB, let's create it
-                swatch = Swatch(**record)
-                session.add(swatch)
-                logger.info(f'swatch ({swatch_id}) added.')
-            # session.commit()
-        ids = []
-        for record in session.execute(db.select([cls])):
-            ids.append(record.id)
+        if not records:
+            return []
+        if force:
+            primary_key = [column.name for column in cls.__table__.primary_key]
+            unique_records = {
+                tuple(record.get(name) for name in primary_key): record
+                for record in records
+            }
+            session.bulk_insert_mappings(cls, list(unique_records.values()))
+            session.commit()
+            logger.info(f'{len(unique_records)} swatches added.')
+            return [record.get('id') for record in records]
+
+        stmt = insert(cls)
+        upsert = stmt.on_conflict_do_update(
+            index_elements=[column for column in cls.__table__.primary_key],
+            set_={
+                column.name: stmt.excluded[column.name]
+                for column in cls.__table__.columns
+                if not column.primary_key
+            },
+        )
+        session.execute(upsert, records)
         session.commit()
-        return ids
+        logger.info(f'{len(records)} swatches added or updated.')
+        return [record.get('id') for record in records]
 
 
 class Swatch(TableBase, Base):
@@ -75,14 +87,6 @@ class Swatch(TableBase, Base):
     lab_a = db.Column(db.Float)
     lab_b = db.Column(db.Float)
 
-    def get_lab_color(self):
-        """
-        Return the Lab color instance for this swatch.
-
-        :return: colormath.color_objects.LabColor
-        """
-        return LabColor(self.lab_l, self.lab_a, self.lab_b)
-
     def get_absolute_url(self):
         """
         Return the URL for this swatch at filamentcolors.xyz.
@@ -0,0 +1,59 @@
+import logging
+
+from filament_colors.logging.formatters import ExtraFormatter
+
+
+def make_record(msg='Swatch updated.', extra=None):
+    """Return a LogRecord as a logger would create it."""
+    return logging.getLogger('test').makeRecord(
+        'test', logging.INFO, __file__, 1, msg, (), None, extra=extra,
+    )
+
+
+def test_format_plain_record():
+    """A record without extra values is formatted as usual."""
+    record = make_record()
+    assert ExtraFormatter().format(record) == 'Swatch updated.'
+    assert record.msg == 'Swatch updated.'
+
+
+def test_format_record_with_extra():
+    """Extra values given to the log call are appended to the message."""
+    record = make_record(extra={'swatch_id': 36, 'hex_color': 'B6D448'})
+    assert ExtraFormatter().format(record) == (
+        'Swatch updated. [swatch_id="36", hex_color="B6D448"]'
+    )
+
+
+def test_format_made_record_with_extra():
+    """Extra values of records made from a dict are appended too."""
+    record = logging.makeLogRecord({
+        'msg': 'Swatch %s updated.', 'args': (36,), 'hex_color': 'B6D448',
+    })
+    assert ExtraFormatter().format(record) == (
+        'Swatch 36 updated. [hex_color="B6D448"]'
+    )
+    record = logging.makeLogRecord({'msg': 'Swatch updated.'})
+    assert ExtraFormatter().format(record) == 'Swatch updated.'
+
+
+def test_normal_keys():
+    """The standard LogRecord attributes are known at the class level."""
+    assert isinstance(ExtraFormatter._NORMAL_KEYS, frozenset)
+    assert ExtraFormatter._NORMAL_KEYS == frozenset(vars(make_record()))
+    assert ExtraFormatter._NUM_NORMAL_KEYS == len(ExtraFormatter._NORMAL_KEYS)
+    # No LogRecord needs to be created per formatter any more.
+    assert '__init__' not in vars(ExtraFormatter)
+
+
+def test_get_extra():
+    """Only attributes outside of the standard ones are extra values."""
+    formatter = ExtraFormatter('%(levelname)s %(message)s')
+    assert formatter.get_extra(make_record()) == {}
+    record = make_record(extra={'swatch_id': 36, 'hex_color': 'B6D448'})
+    assert formatter.get_extra(record) == {
+        'swatch_id': 36, 'hex_color': 'B6D448',
+    }
+    assert formatter.format(record) == (
+        'INFO Swatch updated. [swatch_id="36", hex_color="B6D448"]'
+    )
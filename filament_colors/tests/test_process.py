@@ -0,0 +1,268 @@
+from collections import namedtuple
+
+import numpy as np
+import pytest
+import requests
+
+from filament_colors import process
+from filament_colors.index import SwatchIndex
+
+
+Row = namedtuple('Row', ['id', 'hex_color', 'lab_l', 'lab_a', 'lab_b'])
+SCALES = ([0.01, 1.0, 1.0], None)
+# Run a search test with the linear scan only, or with the KD-tree only.
+search_paths = pytest.mark.parametrize(
+    'tree_min_searches', [10 ** 9, 0], ids=['scan', 'tree'],
+)
+
+
+def make_hex_colors(num_colors, seed):
+    """Return reproducible random RGB colors in hexadecimal format."""
+    rng = np.random.default_rng(seed)
+    return [f'{c:06X}' for c in rng.integers(1 << 24, size=num_colors)]
+
+
+def make_rows(num_swatches, seed=0):
+    """Return rows of random swatches, as loaded from the DB."""
+    hex_colors = make_hex_colors(num_swatches, seed)
+    lab_colors = process.construct_lab_colors_from_hex(hex_colors).tolist()
+    return [Row(i, hex_color, *lab_color) for i, (hex_color, lab_color)
+            in enumerate(zip(hex_colors, lab_colors), start=1)]
+
+
+def find_closest_by_brute_force(rows, hex_color, top_num=1, excluded=(),
+                                scale=None):
+    """Return the IDs of the closest rows by computing every distance."""
+    candidates = [row for row in rows if row.id not in excluded]
+    candidates.sort(key=lambda row: process.compute_lab_color_distance(
+        hex_color, (row.lab_l, row.lab_a, row.lab_b), scale=scale))
+    return [row.id for row in candidates[:top_num]]
+
+
+def make_api(num_swatches, page_size=25, count=True, failing_page=None):
+    """Return a fake get_swatches_from_api serving paginated swatches."""
+    swatches = [{'id': i, 'hex_color': 'BADA55'}
+                for i in range(1, num_swatches + 1)]
+
+    def get_swatches_from_api(page=1):
+        if page == failing_page:
+            return None
+        start = (page - 1) * page_size
+        data = {
+            'next': 'next' if start + page_size < num_swatches else None,
+            'results': swatches[start:start + page_size],
+        }
+        if count:
+            data['count'] = num_swatches
+        return data
+
+    return get_swatches_from_api
+
+
+def test_get_all_swatches_from_api(monkeypatch):
+    """All pages are fetched and merged in order."""
+    monkeypatch.setattr(process, 'get_swatches_from_api', make_api(101))
+    results = process.get_all_swatches_from_api()
+    assert [r['id'] for r in results] == list(range(1, 102))
+
+
+def test_get_all_swatches_from_api_without_count(monkeypatch):
+    """The `next` links are followed when the API omits the count."""
+    monkeypatch.setattr(process, 'get_swatches_from_api',
+                        make_api(101, count=False))
+    results = process.get_all_swatches_from_api()
+    assert [r['id'] for r in results] == list(range(1, 102))
+
+
+def test_get_all_swatches_from_api_failed_page(monkeypatch):
+    """A failed page fails the whole fetch rather than losing swatches."""
+    for count in (True, False):
+        monkeypatch.setattr(process, 'get_swatches_from_api',
+                            make_api(101, count=count, failing_page=3))
+        assert process.get_all_swatches_from_api() is None
+
+
+def test_get_all_swatches_from_api_missing_swatches(monkeypatch):
+    """Receiving fewer swatches than the reported count fails the fetch."""
+    get_page = make_api(101)
+
+    def get_swatches_from_api(page=1):
+        data = get_page(page)
+        if page == 2:
+            data['results'] = data['results'][:-1]
+        return data
+
+    monkeypatch.setattr(process, 'get_swatches_from_api',
+                        get_swatches_from_api)
+    assert process.get_all_swatches_from_api() is None
+
+
+class FakeSession(object):
+    """A stand-in for requests.Session, recording the timeouts used."""
+
+    def __init__(self, error=None):
+        """Instantiate a FakeSession, raising `error` on GET if given."""
+        self.error = error
+        self.timeouts = []
+
+    def get(self, url, timeout=None):
+        """Return an empty page of swatches, or raise the error."""
+        self.timeouts.append(timeout)
+        if self.error:
+            raise self.error
+
+        class Response(object):
+            status_code = 200
+
+            def json(self):
+                return {'count': 0, 'next': None, 'results': []}
+
+        return Response()
+
+
+def test_get_swatches_from_api_timeout(monkeypatch):
+    """Requests are given a timeout."""
+    session = FakeSession()
+    monkeypatch.setattr(process, '_SESSION', session)
+    assert process.get_swatches_from_api(page=2)['results'] == []
+    assert session.timeouts == [process.API_TIMEOUT]
+
+
+@pytest.mark.parametrize('error', [requests.Timeout('timed out'),
+                                   requests.ConnectionError('refused')])
+def test_get_swatches_from_api_error(monkeypatch, error):
+    """A failed request is a failed page, not an exception."""
+    monkeypatch.setattr(process, '_SESSION', FakeSession(error=error))
+    assert process.get_swatches_from_api(page=2) is None
+    assert process.get_all_swatches_from_api() is None
+
+
+@search_paths
+def test_find_closest_by_lab(tree_min_searches):
+    """The search agrees with a brute force search."""
+    rows = make_rows(300)
+    index = SwatchIndex(rows, tree_min_searches=tree_min_searches)
+    for scale in SCALES:
+        for hex_color in make_hex_colors(50, seed=1):
+            for top_num in (1, 5):
+                expected = find_closest_by_brute_force(
+                    rows, hex_color, top_num=top_num, scale=scale)
+                found = process.find_closest_by_lab(
+                    index, hex_color, top_num=top_num, scale=scale)
+                assert [row.id for row in found] == expected
+    # The scan path never builds a tree.
+    assert bool(index._trees) == (tree_min_searches == 0)
+
+
+@search_paths
+def test_find_closest_by_lab_excluded(tree_min_searches):
+    """Excluded swatches among the closest ones are replaced by the next."""
+    rows = make_rows(300)
+    index = SwatchIndex(rows, tree_min_searches=tree_min_searches)
+    for scale in SCALES:
+        for hex_color in make_hex_colors(50, seed=2):
+            closest = find_closest_by_brute_force(rows, hex_color, top_num=3,
+                                                  scale=scale)
+            # Exclude a closest swatch, a duplicate and an unknown ID.
+            excluded = [closest[0], closest[2], closest[0], 9999]
+            for top_num in (1, 3):
+                expected = find_closest_by_brute_force(
+                    rows, hex_color, top_num=top_num, excluded=excluded,
+                    scale=scale)
+                found = process.find_closest_by_lab(
+                    index, hex_color, top_num=top_num, excluded=excluded,
+                    scale=scale)
+                assert [row.id for row in found] == expected
+                assert len(found) == top_num
+
+
+@search_paths
+def test_find_closest_by_lab_few_swatches(tree_min_searches):
+    """Asking for more swatches than available returns all eligible ones."""
+    rows = make_rows(4)
+    index = SwatchIndex(rows, tree_min_searches=tree_min_searches)
+    for scale in SCALES:
+        expected = find_closest_by_brute_force(rows, 'BADA55', top_num=4,
+                                               excluded=[2], scale=scale)
+        found = process.find_closest_by_lab(index, 'BADA55', top_num=10,
+                                            excluded=[2], scale=scale)
+        assert [row.id for row in found] == expected
+        assert len(found) == 3
+
+        found = process.find_closest_by_lab(index, 'BADA55',
+                                            excluded=[1, 2, 3, 4],
+                                            scale=scale)
+        assert found == []
+    empty_index = SwatchIndex([], tree_min_searches=tree_min_searches)
+    assert process.find_closest_by_lab(empty_index, 'BADA55') == []
+
+
+def test_find_closest_by_lab_switches_to_tree():
+    """A tree is only built once enough searches have shared the index."""
+    rows = make_rows(300)
+    index = SwatchIndex(rows, tree_min_searches=3)
+    for num_searches, hex_color in enumerate(make_hex_colors(6, seed=4), 1):
+        expected = find_closest_by_brute_force(rows, hex_color, top_num=5)
+        found = process.find_closest_by_lab(index, hex_color, top_num=5)
+        assert [row.id for row in found] == expected
+        assert bool(index._trees) == (num_searches > 3)
+
+
+def test_construct_lab_colors_from_hex():
+    """The vectorized conversion agrees with colormath's conversion."""
+    hex_colors = make_hex_colors(1000, seed=3)
+    # Black, white, primaries, both sides of the sRGB linearization knee
+    # (0.04045) and of the Lab CIE_E knee (reached near 1D1D1D)
+    hex_colors += [
+        '000000', 'ffffff', 'FF0000', '00FF00', '0000FF', '010101',
+        '0A0A0A', '0B0B0B', '0A0000', '000B00', '1D1D1D', '1E1E1E',
+    ]
+    lab_colors = process.construct_lab_colors_from_hex(hex_colors)
+    assert lab_colors.shape == (len(hex_colors), 3)
+    for hex_color, lab_color in zip(hex_colors, lab_colors.tolist()):
+        expected = process.construct_lab_color_from_hex(hex_color)
+        assert lab_color == pytest.approx(expected.get_value_tuple(),
+                                          rel=1e-9, abs=1e-9)
+    assert process.construct_lab_colors_from_hex([]).shape == (0, 3)
+
+
+@pytest.mark.parametrize('hex_color', ['ABC', 'ABCDEF0', 'zzzzzz',
+                                       'ab cd ', 'ff 00 00', ''])
+def test_construct_lab_colors_from_hex_invalid(hex_color):
+    """Malformed colors are rejected with a consistent error."""
+    with pytest.raises(ValueError, match='6 hexadecimal digits'):
+        process.construct_lab_colors_from_hex(['BADA55', hex_color])
+    with pytest.raises(ValueError, match='6 hexadecimal digits'):
+        process.construct_lab_color_from_hex(hex_color)
+
+
+def test_compute_lab_color_distance():
+    """Distances are scaled per Lab component and accept hex or Lab input."""
+    assert process.compute_lab_color_distance((50, 0, 0), (53, 4, 0)) == 5.0
+    assert process.compute_lab_color_distance(
+        (50, 0, 0), (60, 2, 2), scale=[0.01, 1.0, 1.0]) == pytest.approx(3.0)
+    assert process.compute_lab_color_distance(
+        (53, 4, 0), (50, 0, 0)) == 5.0
+
+    lab_color = process.construct_lab_color_from_hex('BADA55')
+    lab_tuple = lab_color.get_value_tuple()
+    assert process.compute_lab_color_distance('BADA55', lab_tuple) == 0.0
+    assert process.compute_lab_color_distance(
+        'B4E059', 'BADA55') == pytest.approx(
+        process.compute_lab_color_distance('B4E059', lab_tuple))
+
+
+def test_compute_lab_distances_squared():
+    """The vectorized distances are the squares of the scalar distances."""
+    rows = make_rows(50)
+    matrix = SwatchIndex(rows).matrix
+    query = np.array([50.0, -10.0, 20.0])
+    for scale in SCALES:
+        distances = process.compute_lab_distances_squared(matrix, query,
+                                                          scale=scale)
+        expected = [
+            process.compute_lab_color_distance(
+                query, (row.lab_l, row.lab_a, row.lab_b), scale=scale) ** 2
+            for row in rows
+        ]
+        assert distances.tolist() == pytest.approx(expected)
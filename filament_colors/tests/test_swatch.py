@@ -0,0 +1,96 @@
+import pytest
+import sqlalchemy as db
+from sqlalchemy.orm import sessionmaker
+
+from filament_colors.process import populate_db
+from filament_colors.swatch import Base, Swatch
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Return an engine for an empty, temporary SQLite DB."""
+    engine = db.create_engine(f'sqlite:///{tmp_path / "test.sqlite3"}')
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    """Return a session bound to the temporary DB."""
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def make_record(swatch_id, hex_color='BADA55', lab_l=1.0):
+    """Return a swatch record, as built by populate_db."""
+    return {
+        'id': swatch_id,
+        'hex_color': hex_color,
+        'lab_l': lab_l,
+        'lab_a': 2.0,
+        'lab_b': 3.0,
+    }
+
+
+def get_rows(session):
+    """Return the (id, hex_color, lab_l) of all swatches in the DB."""
+    return [
+        (swatch.id, swatch.hex_color, swatch.lab_l)
+        for swatch in session.query(Swatch).order_by(Swatch.id)
+    ]
+
+
+@pytest.mark.parametrize('force', [True, False])
+def test_populate_table_with_records_insert(session, force):
+    """Records are inserted into an empty table."""
+    records = [make_record(1), make_record(2, 'FFFFFF')]
+    ids = Swatch.populate_table_with_records(session, records, force=force)
+    assert ids == [1, 2]
+    assert get_rows(session) == [(1, 'BADA55', 1.0), (2, 'FFFFFF', 1.0)]
+
+
+def test_populate_table_with_records_upsert(session):
+    """Existing rows are updated and new ones added."""
+    Swatch.populate_table_with_records(
+        session, [make_record(1), make_record(2)], force=True)
+    ids = Swatch.populate_table_with_records(
+        session, [make_record(2, 'FF0000', 5.0), make_record(3, '00FF00')])
+    assert ids == [2, 3]
+    assert get_rows(session) == [
+        (1, 'BADA55', 1.0), (2, 'FF0000', 5.0), (3, '00FF00', 1.0),
+    ]
+    assert Swatch.get_count_records(session) == 3
+
+
+@pytest.mark.parametrize('force', [True, False])
+def test_populate_table_with_records_duplicates(session, force):
+    """The last of several records with the same ID wins."""
+    records = [
+        make_record(1), make_record(2), make_record(1, 'FFFFFF', 9.0),
+    ]
+    Swatch.populate_table_with_records(session, records, force=force)
+    assert get_rows(session) == [(1, 'FFFFFF', 9.0), (2, 'BADA55', 1.0)]
+
+
+@pytest.mark.parametrize('force', [True, False])
+def test_populate_table_with_records_empty(session, force):
+    """An empty batch changes nothing."""
+    Swatch.populate_table_with_records(session, [make_record(1)])
+    assert Swatch.populate_table_with_records(session, [], force=force) == []
+    assert get_rows(session) == [(1, 'BADA55', 1.0)]
+
+
+def test_populate_db_force(engine, session):
+    """Forcing rebuilds the table from the given swatches only."""
+    Swatch.populate_table_with_records(session, [make_record(9)])
+    results = [
+        {'id': 1, 'hex_color': '000000'},
+        {'id': 2, 'hex_color': 'FFFFFF'},
+        {'id': 1, 'hex_color': 'FF0000'},
+    ]
+    populate_db(results=results, engine=engine, session=session, force=True)
+    assert [row[:2] for row in get_rows(session)] == [
+        (1, 'FF0000'), (2, 'FFFFFF'),
+    ]